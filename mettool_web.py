@@ -3,11 +3,13 @@ import sys
 import os
 import io  # Use io for in-memory files
 import json
-from pandas.io import json as pd_json # For NaN-safe JSON
+import warnings
+from collections import OrderedDict
+import orjson  # NaN-safe JSON, serializes numpy arrays natively
 import pandas as pd
 import numpy as np
 from scipy import stats
-from copy import deepcopy
+from scipy.linalg.blas import dsyrk
 
 # --- Setup Logging ---
 logging.basicConfig(level=logging.DEBUG,
@@ -23,6 +25,16 @@ class Mettool:
         self.data = pd.DataFrame()
         self.original_data = pd.DataFrame()
         self.column_list = []
+        # Contiguous float64 copy of the numeric columns built by filter_data, reused by the analyses.
+        # Only valid while self.data is the frame filter_data wrote and nothing has written to it since:
+        # selections rebind self.data, which invalidates it; in-place writes after filter_data would not.
+        self._num_block = None
+        self._num_cols = []
+        self._num_source = None
+        # LRU of _period_rows results keyed by (date_column, start, end); entries are views into _dates_cache
+        self._rows_cache = OrderedDict()
+        # Date order of original_data per date column, see _parsed_dates
+        self._dates_cache = {}
 
     def read_data(self) -> bool:
         if not self.input_data_path:
@@ -43,7 +55,10 @@ class Mettool:
 
         try:
             self.data = pd.read_excel(self.input_data_path, sheet_name=self.input_sheet_name, engine=engine)
-            self.original_data = deepcopy(self.data)
+            if self.date_column in self.data.columns:
+                self.data[self.date_column] = pd.to_datetime(self.data[self.date_column], errors='coerce')
+                self.data = self.data.sort_values(by=self.date_column, kind='mergesort')
+            self.original_data = self.data  # read-only; _remove_junk_columns rebinds self.data
             self._remove_junk_columns(0.8)
             logging.info('Loaded %s rows × %s cols', *self.data.shape)
             return True
@@ -52,20 +67,59 @@ class Mettool:
             return False
 
     def _remove_junk_columns(self, threshold: float):
-        nan_frac = self.data.isna().mean()
         numeric_cols = self.data.select_dtypes(include=np.number).columns
-        zero_frac = pd.Series(0, index=self.data.columns)
+        other_cols = self.data.columns.difference(numeric_cols, sort=False)
+        junk_frac = pd.Series(0.0, index=self.data.columns)
+        if not other_cols.empty:
+            junk_frac[other_cols] = self.data[other_cols].isna().mean()
         if not numeric_cols.empty:
-            zero_frac[numeric_cols] = (self.data[numeric_cols] == 0).mean()
+            # NaN and zero are disjoint, so one fused pass gives nan_frac + zero_frac
+            arr = self.data[numeric_cols].to_numpy(dtype=np.float64, na_value=np.nan)
+            junk_frac[numeric_cols] = (np.isnan(arr) | (arr == 0)).mean(axis=0)
 
-        keep_mask = (nan_frac + zero_frac) < threshold
-        if 'Date' in self.data.columns:
-            keep_mask['Date'] = True
+        keep_mask = junk_frac < threshold
+        if self.date_column in self.data.columns:
+            keep_mask[self.date_column] = True
 
         self.data = self.data.loc[:, keep_mask]
         logging.debug('Cols kept: %s', list(self.data.columns))
 
     def select_data(self, start: str, end: str, cols: list[str]):
+        if self.date_column not in cols:
+            cols = cols + [self.date_column]
+
+        rows, dates = self._period_rows(start, end)
+        self.data = self.original_data[cols].iloc[rows]
+        self.data[self.date_column] = dates
+        self.column_list = cols
+        logging.info('select_data → %s rows', len(self.data))
+
+    def _parsed_dates(self) -> tuple[np.ndarray, np.ndarray]:
+        # Positions of the dated rows of original_data in date order, and those dates; built once per date column
+        if self.date_column not in self._dates_cache:
+            df = self.original_data
+            if self.date_column not in df.columns:
+                raise KeyError(f'"{self.date_column}" not found')
+
+            # The default date column is already parsed in read_data; others are parsed here
+            dates = df[self.date_column]
+            if not pd.api.types.is_datetime64_any_dtype(dates):
+                dates = pd.to_datetime(dates, errors='coerce')
+            dates = dates.to_numpy()
+
+            # Already in order when original_data was sorted on this column in read_data
+            order = np.flatnonzero(~np.isnat(dates))
+            if np.any(dates[order][1:] < dates[order][:-1]):
+                order = order[np.argsort(dates[order], kind='stable')]
+            self._dates_cache[self.date_column] = order, dates[order]
+        return self._dates_cache[self.date_column]
+
+    def _period_rows(self, start: str, end: str) -> tuple[np.ndarray, np.ndarray]:
+        key = (self.date_column, start, end)
+        if key in self._rows_cache:
+            self._rows_cache.move_to_end(key)
+            return self._rows_cache[key]
+
         dayfirst = '/' in start
         start_dt = pd.to_datetime(start, dayfirst=dayfirst)
         end_dt = pd.to_datetime(end, dayfirst=dayfirst)
@@ -73,73 +127,159 @@ class Mettool:
         if start_dt > end_dt:
             raise ValueError('Start > End')
 
-        df = self.original_data.copy()
-        if self.date_column not in df.columns:
-            raise KeyError(f'"{self.date_column}" not found')
+        # Rows in [start, end] are one contiguous slice of the date order
+        order, sorted_dates = self._parsed_dates()
+        lo = np.searchsorted(sorted_dates, start_dt.to_datetime64().astype(sorted_dates.dtype), side='left')
+        hi = np.searchsorted(sorted_dates, end_dt.to_datetime64().astype(sorted_dates.dtype), side='right')
 
-        df[self.date_column] = pd.to_datetime(df[self.date_column], errors='coerce')
-        mask = (df[self.date_column] >= start_dt) & (df[self.date_column] <= end_dt)
+        self._rows_cache[key] = order[lo:hi], sorted_dates[lo:hi]
+        if len(self._rows_cache) > 32:
+            self._rows_cache.popitem(last=False)
+        return self._rows_cache[key]
+
+    def select_periods(self, periods: list[dict], cols: list[str]) -> np.ndarray:
+        # Concatenate the period slices (periods may overlap) and label each row with its period
+        order, sorted_dates = self._parsed_dates()
+        selected = [(order[:0], sorted_dates[:0])] + [self._period_rows(p['start'], p['end']) for p in periods]
+        rows = np.concatenate([r for r, _ in selected])
+        dates = np.concatenate([d for _, d in selected])
+        lengths = [len(r) for r, _ in selected[1:]]
 
         if self.date_column not in cols:
             cols = cols + [self.date_column]
 
-        self.data = df.loc[mask, cols].copy()
+        self.data = self.original_data[cols].iloc[rows]
+        self.data[self.date_column] = dates
         self.column_list = cols
-        logging.info('select_data → %s rows', len(self.data))
+        logging.info('select_periods → %s rows in %s periods', len(self.data), len(periods))
+        return np.repeat(np.arange(len(periods)), lengths)
 
     def filter_data(self, replace_zero=True, remove_outliers=False, outlier_method='zscore', outlier_threshold=3.0):
         num = [c for c in self.column_list if c != self.date_column]
-        for c in num:
-            self.data[c] = pd.to_numeric(self.data[c], errors='coerce')
-            if replace_zero:
-                self.data.loc[self.data[c] == 0, c] = np.nan
-
-            if remove_outliers and not self.data[c].isna().all():
+        if not num:
+            return
+
+        block = self.data[num]
+        if not all(pd.api.types.is_numeric_dtype(t) for t in block.dtypes):
+            block = block.apply(pd.to_numeric, errors='coerce')
+        X = np.ascontiguousarray(block.to_numpy(dtype=np.float64, copy=True, na_value=np.nan))
+        if replace_zero:
+            X[X == 0] = np.nan
+
+        if remove_outliers:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN columns are left untouched
                 if outlier_method.lower() == 'zscore':
-                    col_data = self.data[c].dropna()
-                    if not col_data.empty:
-                        z = np.abs(stats.zscore(col_data))
-                        z_series = pd.Series(z, index=col_data.index)
-                        self.data.loc[z_series > outlier_threshold, c] = np.nan
+                    # |x - mean| > thr * std, reusing one deviation buffer for std and the mask
+                    dev = X - np.nanmean(X, axis=0)
+                    sd = np.sqrt(np.nanmean(dev * dev, axis=0))
+                    np.abs(dev, out=dev)
+                    X[dev > outlier_threshold * sd] = np.nan
 
                 elif outlier_method.lower() == 'iqr':
-                    q1 = self.data[c].quantile(0.25)
-                    q3 = self.data[c].quantile(0.75)
+                    q1, q3 = np.nanpercentile(X, [25, 75], axis=0)
                     iqr = q3 - q1
                     lo = q1 - (outlier_threshold * iqr)
                     hi = q3 + (outlier_threshold * iqr)
-                    self.data.loc[(self.data[c] < lo) | (self.data[c] > hi), c] = np.nan
+                    X[(X < lo) | (X > hi)] = np.nan
+
+        self.data[num] = X
+        self._num_block = X
+        self._num_cols = num
+        self._num_source = self.data
+
+    def _numeric_block(self, cols: list[str]) -> np.ndarray:
+        # Reuse the filter_data block while self.data is still the frame it was built from.
+        # Internal to Mettool's analysis methods; code outside the class reads self.data.
+        if self._num_block is not None and self._num_source is self.data and set(cols) <= set(self._num_cols):
+            if list(cols) == self._num_cols:
+                return self._num_block
+            return self._num_block[:, [self._num_cols.index(c) for c in cols]]
+        return self.data[cols].to_numpy(dtype=np.float64, na_value=np.nan)
+
+    def export_filtered_data(self, sheet: str, fmt: str = 'xlsx') -> memoryview:
+        if fmt not in {'xlsx', 'csv'}:
+            raise ValueError(f'Unsupported export format {fmt}')
 
-    def export_filtered_data(self, sheet: str) -> bytes:
         try:
             buf = io.BytesIO()
-            with pd.ExcelWriter(buf, engine='openpyxl') as wt:
-                self.data.to_excel(wt, sheet_name=sheet, index=False)
-            logging.debug('Exported %s to in-memory buffer', sheet)
-            return buf.getvalue()
+            if fmt == 'csv':
+                self.data.to_csv(buf, index=False, encoding='utf-8-sig')  # BOM so Excel detects UTF-8
+            else:
+                with pd.ExcelWriter(buf, engine='xlsxwriter') as wt:
+                    self.data.to_excel(wt, sheet_name=sheet, index=False)
+            logging.debug('Exported %s (%s) to in-memory buffer', sheet, fmt)
+            # Zero-copy view of the buffer; the worker's toJs() makes the only copy into JS memory
+            return buf.getbuffer()
         except Exception:
             logging.error('export_filtered_data failed', exc_info=True)
-            return b""
+            return memoryview(b"")
 
     def correlation(self):
         numeric_cols = self.data.select_dtypes(include=np.number).columns
-        return self.data[numeric_cols].corr()
+        arr = self._numeric_block(list(numeric_cols))
+        if arr.shape[1] == 0:
+            return pd.DataFrame(index=numeric_cols, columns=numeric_cols, dtype=np.float64)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            valid = ~np.isnan(arr)
+            if valid.all() and arr.shape[1] > 16 and len(arr) > 0:
+                # Wide block: standardize and let dsyrk fill only the upper triangle, then mirror
+                sd = arr.std(axis=0)
+                x = (arr - arr.mean(axis=0)) / sd
+                c = dsyrk(1.0 / len(arr), x.T)
+                c = np.triu(c) + np.triu(c, 1).T
+                np.fill_diagonal(c, np.where(sd > 0, 1.0, np.nan))
+            elif valid.all():
+                c = np.corrcoef(arr.T)
+            else:
+                # Pairwise-complete Pearson from masked gram matrices (matches DataFrame.corr to rounding)
+                m = valid.astype(np.float64)
+                x = np.where(valid, arr - np.nanmean(arr, axis=0), 0.0)
+                n = m.T @ m
+                sx = x.T @ m
+                sxx = (x * x).T @ m
+                cov = x.T @ x - sx * sx.T / n
+                c = cov / np.sqrt((sxx - sx * sx / n) * (sxx - sx * sx / n).T)
+            c = np.clip(np.atleast_2d(c), -1.0, 1.0)
+
+        return pd.DataFrame(c, index=numeric_cols, columns=numeric_cols)
 
     def cusum(self, col: str):
-        return (self.data[col] - self.data[col].mean()).cumsum()
+        return pd.Series(self.cusum_matrix([col])[:, 0], index=self.data.index, name=col)
+
+    def cusum_matrix(self, cols: list[str]) -> np.ndarray:
+        X = self._numeric_block(cols)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN columns stay NaN
+            D = X - np.nanmean(X, axis=0)
+        # Like Series.cumsum: missing values are skipped and stay NaN in the output
+        C = np.nancumsum(D, axis=0)
+        C[np.isnan(D)] = np.nan
+        return C
 
     def control_limits(self, col: str, conf: float):
-        s = self.data[col].dropna()
-        if len(s) < 2:
-            return np.nan, np.nan
-
-        m = s.mean()
-        t = stats.t.ppf(1 - (1 - (conf / 100.0)) / 2, df=len(s) - 1)
-        se = s.std(ddof=1) / np.sqrt(len(s))
-
-        upper = m + t * se
-        lower = m - t * se
-        return upper, lower
+        _, upper, lower = self.period_limits(col, conf, np.zeros(len(self.data), dtype=np.intp), 1)
+        return upper[0], lower[0]
+
+    def period_limits(self, col: str, conf: float, labels: np.ndarray, n_periods: int):
+        # Mean ± t * s / sqrt(n) for every period at once; periods with fewer than 2 points give NaN.
+        # Per-period count/mean/std are two bincount passes over the non-NaN values (std is two-pass).
+        v = self._numeric_block([col])[:, 0]
+        ok = ~np.isnan(v)
+        lab, x = labels[ok], v[ok]
+        counts = np.bincount(lab, minlength=n_periods).astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.bincount(lab, weights=x, minlength=n_periods) / counts
+            dev = x - mean[lab]
+            std = np.sqrt(np.bincount(lab, weights=dev * dev, minlength=n_periods) / (counts - 1))
+            t = stats.t.ppf(1 - (1 - (conf / 100.0)) / 2, df=counts - 1)
+            se = std / np.sqrt(counts)
+
+        upper = mean + t * se
+        lower = mean - t * se
+        return mean, upper, lower
 
     def get_data(self):
         return self.data.copy()
@@ -148,6 +288,19 @@ class Mettool:
 mettool_instance = Mettool()
 
 
+# --- JSON Encoding ---
+
+def _json_default(obj):
+    # orjson only handles C-contiguous numeric arrays natively; anything else goes through tolist()
+    if isinstance(obj, (np.ndarray, pd.Index, pd.Series)):
+        return obj.tolist()
+    raise TypeError(f'Type is not JSON serializable: {type(obj).__name__}')
+
+def _json(obj) -> str:
+    # NaN/inf (plain or inside float arrays) are written as null, as pandas' encoder did
+    return orjson.dumps(obj, default=_json_default, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+
 # --- Web-Facing Functions (Called from JavaScript) ---
 
 def get_sheet_names_from_buffer(buffer) -> list:
@@ -186,14 +339,14 @@ def run_correlation(params_proxy: dict) -> dict:
     corr_matrix = m.correlation()
 
     plot_data = {
-        'z': corr_matrix.values.tolist(),
+        'z': np.ascontiguousarray(corr_matrix.to_numpy()),
         'x': corr_matrix.columns.tolist(),
         'y': corr_matrix.columns.tolist()
     }
 
-    file_buffer = m.export_filtered_data('Correlation')
+    file_buffer = m.export_filtered_data('Correlation', params.get('fmt', 'xlsx'))
 
-    return {'plot_data_json': pd_json.dumps(plot_data), 'file_buffer': file_buffer}
+    return {'plot_data_json': _json(plot_data), 'file_buffer': file_buffer}
 
 
 def run_cusum(params_proxy: dict) -> dict:
@@ -205,24 +358,23 @@ def run_cusum(params_proxy: dict) -> dict:
     m.select_data(params['start'], params['end'], params['cols'])
     m.filter_data()
 
-    df = m.get_data().sort_values(by=m.date_column)
-
+    cusums = m.cusum_matrix(params['cols'])
     traces = []
-    for col in params['cols']:
+    for j, col in enumerate(params['cols']):
         traces.append({
             'name': f'CUSUM {col}',
-            'data': m.cusum(col).tolist()
+            'data': np.ascontiguousarray(cusums[:, j])
         })
 
     plot_data = {
-        'dateCol': df[m.date_column].dt.strftime('%Y-%m-%d').tolist(),
+        'dateCol': np.datetime_as_string(m.data[m.date_column].to_numpy(), unit='D').tolist(),
         'dateColName': m.date_column,
         'traces': traces
     }
 
-    file_buffer = m.export_filtered_data('CUSUM')
+    file_buffer = m.export_filtered_data('CUSUM', params.get('fmt', 'xlsx'))
 
-    return {'plot_data_json': pd_json.dumps(plot_data), 'file_buffer': file_buffer}
+    return {'plot_data_json': _json(plot_data), 'file_buffer': file_buffer}
 
 
 def run_control_graph(params_proxy: dict) -> dict:
@@ -238,37 +390,36 @@ def run_control_graph(params_proxy: dict) -> dict:
     palette = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd',
                '#8c564b', '#e377c2', '#7f7f0f', '#bcbd22', '#17becf']
 
-    full_period_data = []
+    m = mettool_instance
+    m.date_column = params['dateCol']
+    labels = m.select_periods(periods, [col, m.date_column])
+    m.filter_data()
+
+    avgs, ucls, lcls = m.period_limits(col, conf, labels, len(periods))
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(labels, minlength=len(periods)))))
+    # Format every selected date once (YYYY-MM-DD); each period takes a slice
+    date_strs = np.datetime_as_string(m.data[m.date_column].to_numpy(), unit='D')
+    values = np.ascontiguousarray(m.data[col].to_numpy(dtype=np.float64))
 
     for i, period in enumerate(periods):
         s, e = period['start'], period['end']
         color = palette[i % len(palette)]
 
-        tmp = Mettool(mettool_instance.input_data_path, mettool_instance.input_sheet_name)
-        tmp.date_column = params['dateCol']
-        tmp.original_data = deepcopy(mettool_instance.original_data)
-
-        tmp.select_data(s, e, [col, tmp.date_column])
-        tmp.filter_data()
-
-        d = tmp.get_data().sort_values(by=tmp.date_column)
-        full_period_data.append(d)
-
         # Data points (in color)
         plot_traces.append({
-            'x': d[tmp.date_column].dt.strftime('%Y-%m-%d').tolist(),
-            'y': d[col].tolist(),
+            'x': date_strs[bounds[i]:bounds[i + 1]].tolist(),
+            'y': values[bounds[i]:bounds[i + 1]],
             'name': f'{s} – {e}',
             'mode': 'markers',
             'color': color, # Use the period color
-            'dateColName': tmp.date_column
+            'dateColName': m.date_column
         })
 
         period_start_dt = pd.to_datetime(s, dayfirst=True).strftime('%Y-%m-%d')
         period_end_dt = pd.to_datetime(e, dayfirst=True).strftime('%Y-%m-%d')
 
         if params['showLim']:
-            up, lo = tmp.control_limits(col, conf)
+            up, lo = ucls[i], lcls[i]
             if not np.isnan(up):
                 # UCL Line (neutral gray)
                 plot_traces.append({
@@ -294,7 +445,7 @@ def run_control_graph(params_proxy: dict) -> dict:
 
 
         if params['showAvg']:
-            avg = d[col].mean()
+            avg = avgs[i]
             if not np.isnan(avg):
                 # Average Line (neutral gray)
                 plot_traces.append({
@@ -308,11 +459,6 @@ def run_control_graph(params_proxy: dict) -> dict:
             else:
                 plot_traces.append({'x': [], 'y': [], 'mode': 'lines'})
 
-    if full_period_data:
-        mettool_instance.data = pd.concat(full_period_data)
-    else:
-        mettool_instance.data = pd.DataFrame()
-
-    file_buffer = mettool_instance.export_filtered_data('Control')
+    file_buffer = m.export_filtered_data('Control', params.get('fmt', 'xlsx'))
 
-    return {'plot_data_json': pd_json.dumps(plot_traces), 'file_buffer': file_buffer}
\ No newline at end of file
+    return {'plot_data_json': _json(plot_traces), 'file_buffer': file_buffer}
\ No newline at end of file
@@ -7,10 +7,20 @@ let periods = [];
 let lastCorrBuffer = null;
 let lastCusumBuffer = null;
 let lastCtrlBuffer = null;
+let lastCorrFormat = null;
+let lastCusumFormat = null;
+let lastCtrlFormat = null;
+
+// File extension and MIME type for each export format produced by the worker
+const exportFormats = {
+    csv: { ext: 'csv', mime: 'text/csv' },
+    xlsx: { ext: 'xlsx', mime: 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet' }
+};
 
 // --- DOM Element Cache ---
 const fileInput = document.getElementById('file-input');
 const sheetSelect = document.getElementById('sheet-name');
+const exportFormatSelect = document.getElementById('export-format');
 const btnLoad = document.getElementById('btn-load');
 const btnClear = document.getElementById('btn-clear');
 
@@ -116,12 +126,24 @@ function populateColumnLists(columns) {
     });
 }
 
-function triggerDownload(buffer, filename) {
+/**
+ * Shows which file format an Export button will download (fixed when the plot was made).
+ * @param {HTMLButtonElement} button The export button.
+ * @param {string | null} fmt The export format, or null to reset the label.
+ */
+function setExportFormatLabel(button, fmt) {
+    const format = exportFormats[fmt];
+    button.textContent = format ? `Export Data (.${format.ext})` : 'Export Data';
+}
+
+function triggerDownload(buffer, basename, fmt) {
     if (!buffer || buffer.byteLength === 0) {
         showToast('No data to export.', 'error');
         return;
     }
-    const blob = new Blob([buffer], { type: 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet' });
+    const format = exportFormats[fmt] || exportFormats.xlsx;
+    const filename = `${basename}.${format.ext}`;
+    const blob = new Blob([buffer], { type: format.mime });
     const url = URL.createObjectURL(blob);
     const a = document.createElement('a');
     a.href = url;
@@ -177,6 +199,8 @@ worker.onmessage = (e) => {
             setButtonLoading(btnPlotCorr, false); // Stop spinner
             drawCorrelationPlot(payload.plotData);
             lastCorrBuffer = payload.fileBuffer; // Save buffer
+            lastCorrFormat = payload.fmt;
+            setExportFormatLabel(btnExportCorr, payload.fmt);
             btnExportCorr.disabled = false; // Enable export
             break;
 
@@ -184,6 +208,8 @@ worker.onmessage = (e) => {
             setButtonLoading(btnPlotCusum, false); // Stop spinner
             drawCusumPlot(payload.plotData);
             lastCusumBuffer = payload.fileBuffer; // Save buffer
+            lastCusumFormat = payload.fmt;
+            setExportFormatLabel(btnExportCusum, payload.fmt);
             btnExportCusum.disabled = false; // Enable export
             break;
 
@@ -191,6 +217,8 @@ worker.onmessage = (e) => {
             setButtonLoading(btnPlotCtrl, false); // Stop spinner
             drawControlGraphPlot(payload.plotData, payload.col, payload.conf);
             lastCtrlBuffer = payload.fileBuffer; // Save buffer
+            lastCtrlFormat = payload.fmt;
+            setExportFormatLabel(btnExportCtrl, payload.fmt);
             btnExportCtrl.disabled = false; // Enable export
             break;
     }
@@ -236,8 +264,14 @@ btnClear.onclick = () => {
     btnExportCusum.disabled = true;
     btnExportCtrl.disabled = true;
     lastCorrBuffer = null;
+    lastCorrFormat = null;
+    setExportFormatLabel(btnExportCorr, null);
     lastCusumBuffer = null;
+    lastCusumFormat = null;
+    setExportFormatLabel(btnExportCusum, null);
     lastCtrlBuffer = null;
+    lastCtrlFormat = null;
+    setExportFormatLabel(btnExportCtrl, null);
     // Clear plot areas
     document.getElementById('plot-corr').innerHTML = '';
     document.getElementById('plot-cusum').innerHTML = '';
@@ -252,7 +286,8 @@ btnPlotCorr.onclick = () => {
         start: document.getElementById('corr-start').value,
         end: document.getElementById('corr-end').value,
         dateCol: document.getElementById('corr-date-col').value,
-        cols: selectedCols
+        cols: selectedCols,
+        fmt: exportFormatSelect.value
     };
     if (!payload.start || !payload.end || payload.cols.length === 0) {
         showToast('Please select dates and at least one column.', 'error');
@@ -262,7 +297,7 @@ btnPlotCorr.onclick = () => {
     worker.postMessage({ type: 'runCorrelation', payload });
 };
 btnExportCorr.onclick = () => {
-    triggerDownload(lastCorrBuffer, 'Output_Correlation.xlsx');
+    triggerDownload(lastCorrBuffer, 'Output_Correlation', lastCorrFormat);
 };
 
 
@@ -276,7 +311,8 @@ btnPlotCusum.onclick = () => {
         start: document.getElementById('cusum-start').value,
         end: document.getElementById('cusum-end').value,
         dateCol: document.getElementById('cusum-date-col').value,
-        cols: selectedCols
+        cols: selectedCols,
+        fmt: exportFormatSelect.value
     };
     if (!payload.start || !payload.end) {
         showToast('Please select dates.', 'error');
@@ -286,7 +322,7 @@ btnPlotCusum.onclick = () => {
     worker.postMessage({ type: 'runCusum', payload });
 };
 btnExportCusum.onclick = () => {
-    triggerDownload(lastCusumBuffer, 'Output_CUSUM.xlsx');
+    triggerDownload(lastCusumBuffer, 'Output_CUSUM', lastCusumFormat);
 };
 
 btnAddPeriod.onclick = () => {
@@ -348,12 +384,13 @@ btnPlotCtrl.onclick = () => {
         periods: periods,
         showLim: document.getElementById('ctrl-show-lim').checked,
         showAvg: document.getElementById('ctrl-show-avg').checked,
+        fmt: exportFormatSelect.value,
     };
     setButtonLoading(btnPlotCtrl, true); // Start spinner
     worker.postMessage({ type: 'runControlGraph', payload });
 };
 btnExportCtrl.onclick = () => {
-    triggerDownload(lastCtrlBuffer, 'Output_Control.xlsx');
+    triggerDownload(lastCtrlBuffer, 'Output_Control', lastCtrlFormat);
 };
 
 // --- Plotting Functions (using Plotly.js) ---
@@ -22,7 +22,9 @@ async function loadPyodideAndPackages() {
         'numpy',
         'scipy',
         'openpyxl',
-        'xlrd'
+        'xlsxwriter',
+        'xlrd',
+        'orjson'
     ]);
     console.log('All packages installed.');
 
@@ -106,7 +108,7 @@ self.onmessage = async (e) => {
                 // 3. Post the message and transfer the buffer
                 postMessage({
                     type: 'correlationResult',
-                    payload: { plotData, fileBuffer }
+                    payload: { plotData, fileBuffer, fmt: payload.fmt }
                 }, [fileBuffer.buffer]);
 
                 // 4. Clean up proxies
@@ -126,7 +128,7 @@ self.onmessage = async (e) => {
 
                 postMessage({
                     type: 'cusumResult',
-                    payload: { plotData, fileBuffer }
+                    payload: { plotData, fileBuffer, fmt: payload.fmt }
                 }, [fileBuffer.buffer]);
 
                 fileBufferPy.destroy();
@@ -149,6 +151,7 @@ self.onmessage = async (e) => {
                     payload: {
                         plotData, // This is now a pure JS object
                         fileBuffer,
+                        fmt: payload.fmt,
                         col: payload.col,
                         conf: payload.conf
                     }